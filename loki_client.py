@@ -1,21 +1,127 @@
 """Loki API client with log analysis utilities."""
 
+import asyncio
+import sys
 import httpx
+import msgspec
+import re2
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Optional, Any
+from typing import Optional, Any, Iterator
 from collections import Counter
+from time import monotonic
 import re
 
+ERROR_KEYWORDS = ("ERROR", "PANIC", "FATAL")
+_ERROR_PATTERN = "|".join(ERROR_KEYWORDS)
+RESTART_KEYWORDS = ("restart", "CrashLoopBackOff", "OOMKilled")
+_RESTART_PATTERN = "|".join(RESTART_KEYWORDS)
+LABEL_CACHE_TTL_SECONDS = 60.0
+REGEX_MAX_MEM_BYTES = 8 << 20
+_REGEX_METACHARACTERS = frozenset(".*+?()[]{}|\\^$")
+_LEVEL_RE = re.compile(r"\b(ERROR|WARN|WARNING|PANIC|FATAL|DEBUG|INFO|TRACE)\b", re.IGNORECASE)
+
+
+class Stream(msgspec.Struct):
+    """One log stream: its label set and (timestamp_ns, line) pairs."""
+
+    stream: dict[str, str] = {}
+    values: list[tuple[str, str]] = []
+
+
+class StreamsData(msgspec.Struct):
+    result: list[Stream] = []
+
+
+class StreamsResponse(msgspec.Struct):
+    """Response body of a LogQL log query."""
+
+    data: StreamsData
+
+
+class Series(msgspec.Struct):
+    """One metric sample: its label set and (timestamp, value) pair."""
+
+    value: tuple[float, str]
+    metric: dict[str, str] = {}
+
+
+class VectorData(msgspec.Struct):
+    result: list[Series] = []
+
+
+class VectorResponse(msgspec.Struct):
+    """Response body of a LogQL instant metric query."""
+
+    data: VectorData
+
+
+class LabelValuesResponse(msgspec.Struct):
+    data: list[str] = []
+
+
+_STREAMS_DECODER = msgspec.json.Decoder(StreamsResponse)
+_VECTOR_DECODER = msgspec.json.Decoder(VectorResponse)
+_LABEL_VALUES_DECODER = msgspec.json.Decoder(LabelValuesResponse)
+
+
+@dataclass
+class LogBatch:
+    """Log lines from a Loki response stored as parallel columns."""
+
+    timestamps: list[int] = field(default_factory=list)
+    messages: list[str] = field(default_factory=list)
+    pod_names: list[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
 
 class LokiClient:
     def __init__(self, loki_url: str = "http://loki.monitoring.svc.cluster.local:3100"):
         self.url = loki_url
-        self.client = httpx.Client(timeout=30.0)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._label_cache: dict[tuple[str, str], tuple[float, list[str]]] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Return the pooled HTTP client, creating it on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                http2=True,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     def _escape_logql_string(self, value: str) -> str:
         """Escape user-provided content for LogQL string literals."""
         return value.replace("\\", "\\\\").replace('"', '\\"')
 
+    def validate_regex(self, pattern: str) -> None:
+        """Reject user regexes that Loki's RE2 engine would refuse.
+
+        Raises:
+            ValueError: If the pattern is not valid RE2 syntax or compiles to
+                more than REGEX_MAX_MEM_BYTES.
+        """
+        options = re2.Options()
+        options.max_mem = REGEX_MAX_MEM_BYTES
+        options.log_errors = False
+        try:
+            re2.compile(pattern, options)
+        except re2.error as e:
+            reason = e.args[0] if e.args else ""
+            if isinstance(reason, bytes):
+                reason = reason.decode("utf-8", "replace")
+            raise ValueError(f"Invalid regex {pattern!r}: {reason}") from e
+
     def _stream_selector(self, namespace: str = "") -> str:
         """Build a valid Loki stream selector for all or one namespace."""
         if namespace:
@@ -23,14 +129,22 @@ class LokiClient:
             return f'{{namespace="{escaped_namespace}"}}'
         return '{namespace=~".+"}'
 
-    def query_range(
+    async def query_range(
         self,
         query: str,
         start: Optional[datetime] = None,
         end: Optional[datetime] = None,
         limit: int = 1000,
-    ) -> dict[str, Any]:
-        """Execute a LogQL range query."""
+        max_line_chars: Optional[int] = None,
+    ) -> StreamsResponse:
+        """Execute a LogQL range query.
+
+        If max_line_chars is set, Loki truncates each log line to that many
+        characters (via line_format trunc) before sending it. Only valid for
+        log (not metric) queries.
+        """
+        if max_line_chars is not None:
+            query = f'{query} | line_format "{{{{ __line__ | trunc {max_line_chars} }}}}"'
         if not start:
             start = datetime.now() - timedelta(hours=1)
         if not end:
@@ -43,51 +157,111 @@ class LokiClient:
             "limit": limit,
         }
 
-        resp = self.client.get(f"{self.url}/loki/api/v1/query_range", params=params)
+        resp = await self.client.get(f"{self.url}/loki/api/v1/query_range", params=params)
+        resp.raise_for_status()
+        return _STREAMS_DECODER.decode(resp.content)
+
+    async def query(self, query: str, time: Optional[datetime] = None) -> VectorResponse:
+        """Execute a LogQL instant query (used for metric queries)."""
+        if not time:
+            time = datetime.now()
+
+        params = {
+            "query": query,
+            "time": int(time.timestamp()) * 1_000_000_000,
+        }
+
+        resp = await self.client.get(f"{self.url}/loki/api/v1/query", params=params)
         resp.raise_for_status()
-        return resp.json()
+        return _VECTOR_DECODER.decode(resp.content)
 
-    def get_labels(self, label_name: str) -> list[str]:
-        """Get all values for a label."""
-        resp = self.client.get(
-            f"{self.url}/loki/api/v1/label/{label_name}/values"
+    async def get_labels(self, label_name: str, query: str = "") -> list[str]:
+        """Get all values for a label, cached for LABEL_CACHE_TTL_SECONDS."""
+        key = (label_name, query)
+        now = monotonic()
+        cached = self._label_cache.get(key)
+        if cached and now - cached[0] < LABEL_CACHE_TTL_SECONDS:
+            return list(cached[1])
+
+        resp = await self.client.get(
+            f"{self.url}/loki/api/v1/label/{label_name}/values",
+            params={"query": query} if query else None,
         )
         resp.raise_for_status()
-        return resp.json().get("data", [])
+        values = _LABEL_VALUES_DECODER.decode(resp.content).data
+        self._label_cache[key] = (now, values)
+        return list(values)
 
-    def get_namespaces(self) -> list[str]:
+    async def get_namespaces(self) -> list[str]:
         """Get all namespaces in logs."""
-        return self.get_labels("namespace")
+        return await self.get_labels("namespace")
 
-    def get_pods_in_namespace(self, namespace: str) -> list[str]:
+    async def get_pods_in_namespace(self, namespace: str) -> list[str]:
         """Get all pods in a namespace."""
-        resp = self.client.get(
-            f"{self.url}/loki/api/v1/label/pod_name/values",
-            params={"query": f'{{namespace="{namespace}"}}'},
-        )
-        resp.raise_for_status()
-        return resp.json().get("data", [])
-
-    def parse_log_entries(self, result: dict) -> list[dict]:
-        """Parse Loki response into structured log entries."""
-        entries = []
-        for stream in result.get("data", {}).get("result", []):
-            labels = stream.get("stream", {})
-            for timestamp_ns_str, line in stream.get("values", []):
-                entries.append({
-                    "timestamp": datetime.fromtimestamp(int(timestamp_ns_str) / 1_000_000_000),
-                    "message": line,
-                    "labels": labels,
-                })
-        return entries
+        return await self.get_labels("pod_name", query=self._stream_selector(namespace))
+
+    def parse_log_entries(self, result: StreamsResponse) -> LogBatch:
+        """Parse Loki response into a columnar batch of log lines.
+
+        Timestamps are kept as integer nanoseconds; use to_datetime() for the
+        lines that are actually displayed.
+        """
+        batch = LogBatch()
+        for stream in result.data.result:
+            # Labels are constant within a stream, so resolve the pod once
+            pod = sys.intern(stream.stream.get("pod_name", "unknown"))
+            values = stream.values
+            batch.timestamps.extend(int(timestamp_ns_str) for timestamp_ns_str, _ in values)
+            batch.messages.extend(line for _, line in values)
+            batch.pod_names.extend([pod] * len(values))
+        return batch
+
+    def _iter_messages(self, result: StreamsResponse) -> Iterator[tuple[str, str]]:
+        """Yield (pod_name, message) pairs without parsing timestamps."""
+        for stream in result.data.result:
+            pod = sys.intern(stream.stream.get("pod_name", "unknown"))
+            for _, line in stream.values:
+                yield pod, line
+
+    def to_datetime(self, timestamp_ns: int) -> datetime:
+        """Convert a Loki nanosecond timestamp to a datetime."""
+        return datetime.fromtimestamp(timestamp_ns / 1_000_000_000)
+
+    def parse_vector_counts(self, result: VectorResponse, label: str = "pod_name") -> Counter:
+        """Parse a metric query vector into counts keyed by a label value."""
+        counts = Counter()
+        for series in result.data.result:
+            key = sys.intern(series.metric.get(label) or "unknown")
+            counts[key] += int(float(series.value[1]))
+        return counts
+
+    async def _count_lines_by_pod(
+        self,
+        selector: str,
+        keywords: tuple[str, ...],
+        hours: int,
+    ) -> list[Counter]:
+        """Count lines containing any keyword, per pod, using literal filters only.
+
+        Each keyword gets its own concurrent query that also excludes the
+        keywords before it, so the returned per-partition counts are disjoint
+        and can be summed without counting a line twice. The first partition
+        excludes nothing, so its total is the full count for keywords[0].
+        """
+        queries = []
+        for i, keyword in enumerate(keywords):
+            excluded = "".join(f' != "{previous}"' for previous in keywords[:i])
+            line_filter = f'{selector}{excluded} |= "{keyword}"'
+            queries.append(self.query(f"sum by (pod_name) (count_over_time({line_filter} [{hours}h]))"))
+
+        return [self.parse_vector_counts(result) for result in await asyncio.gather(*queries)]
 
     def extract_error_level(self, message: str) -> Optional[str]:
         """Extract error level from log message."""
-        level_pattern = r"\b(ERROR|WARN|WARNING|PANIC|FATAL|DEBUG|INFO|TRACE)\b"
-        match = re.search(level_pattern, message, re.IGNORECASE)
+        match = _LEVEL_RE.search(message)
         return match.group(1).upper() if match else None
 
-    def get_error_summary(
+    async def get_error_summary(
         self,
         namespace: str = "",
         hours: int = 1,
@@ -95,43 +269,43 @@ class LokiClient:
         """Get summary of errors in timeframe."""
         start = datetime.now() - timedelta(hours=hours)
         selector = self._stream_selector(namespace)
-        query = f'{selector} |~ "(ERROR|PANIC|FATAL)"'
+        error_filter = f'{selector} |~ "{_ERROR_PATTERN}"'
 
-        result = self.query_range(query, start=start, limit=5000)
-        entries = self.parse_log_entries(result)
+        # Let Loki do the counting; only a handful of raw lines come back as samples
+        partitions, samples_result, *keyword_results = await asyncio.gather(
+            self._count_lines_by_pod(selector, ERROR_KEYWORDS, hours),
+            self.query_range(error_filter, start=start, limit=10, max_line_chars=200),
+            # The first keyword's total comes from its partition
+            *(
+                self.query(f'sum(count_over_time({selector} |= "{keyword}" [{hours}h]))')
+                for keyword in ERROR_KEYWORDS[1:]
+            ),
+        )
 
-        # Analyze errors
+        errors_by_pod = sum(partitions, Counter())
         error_types = Counter()
-        error_messages = []
-        affected_pods = set()
-
-        for entry in entries:
-            msg = entry["message"]
-            pod = entry["labels"].get("pod_name", "unknown")
-            affected_pods.add(pod)
-
-            # Try to extract error type
-            if "ERROR" in msg:
-                error_types["ERROR"] += 1
-            if "PANIC" in msg:
-                error_types["PANIC"] += 1
-            if "FATAL" in msg:
-                error_types["FATAL"] += 1
-
-            # Store unique error messages (limit to 10)
-            if len(error_messages) < 10:
-                error_messages.append(msg[:200])  # Truncate long messages
+        keyword_counts = [sum(partitions[0].values())] + [
+            sum(self.parse_vector_counts(result).values()) for result in keyword_results
+        ]
+        for keyword, count in zip(ERROR_KEYWORDS, keyword_counts):
+            if count:
+                error_types[keyword] = count
+
+        error_messages = [
+            msg[:200]  # Truncate long messages
+            for _, msg in self._iter_messages(samples_result)
+        ]
 
         return {
-            "total_errors": len(entries),
+            "total_errors": sum(errors_by_pod.values()),
             "time_range_hours": hours,
             "error_breakdown": dict(error_types.most_common()),
-            "affected_pods": list(affected_pods),
+            "affected_pods": list(errors_by_pod),
             "sample_errors": error_messages,
             "namespaces": [namespace] if namespace else ["all"],
         }
 
-    def get_pod_restarts(
+    async def get_pod_restarts(
         self,
         namespace: str = "",
         hours: int = 1,
@@ -139,29 +313,29 @@ class LokiClient:
         """Find pods that have restarted recently."""
         start = datetime.now() - timedelta(hours=hours)
         selector = self._stream_selector(namespace)
-        query = f'{selector} |~ "(restart|CrashLoopBackOff|OOMKilled)"'
+        query = f'{selector} |~ "({_RESTART_PATTERN})"'
 
-        result = self.query_range(query, start=start, limit=5000)
-        entries = self.parse_log_entries(result)
+        # Counts come from Loki; raw lines are only fetched to show a reason per pod
+        partitions, reasons_result = await asyncio.gather(
+            self._count_lines_by_pod(selector, RESTART_KEYWORDS, hours),
+            self.query_range(query, start=start, limit=1000, max_line_chars=200),
+        )
 
-        # Group by pod
-        restarts_by_pod = Counter()
+        restarts_by_pod = sum(partitions, Counter())
         restart_reasons = {}
 
-        for entry in entries:
-            pod = entry["labels"].get("pod_name", "unknown")
-            restarts_by_pod[pod] += 1
+        for pod, msg in self._iter_messages(reasons_result):
             if pod not in restart_reasons:
-                restart_reasons[pod] = entry["message"][:200]
+                restart_reasons[pod] = msg[:200]
 
         return {
-            "total_restart_events": len(entries),
+            "total_restart_events": sum(restarts_by_pod.values()),
             "affected_pods": dict(restarts_by_pod.most_common(10)),
             "restart_reasons": restart_reasons,
             "time_range_hours": hours,
         }
 
-    def search_logs(
+    async def search_logs(
         self,
         query: str,
         namespace: str = "",
@@ -172,25 +346,26 @@ class LokiClient:
         start = datetime.now() - timedelta(hours=hours)
         selector = self._stream_selector(namespace)
         escaped_query = self._escape_logql_string(query)
-        logql = f'{selector} |~ "{escaped_query}"'
+        # Plain strings use Loki's substring filter instead of the regex engine
+        operator = "|~" if _REGEX_METACHARACTERS.intersection(query) else "|="
+        logql = f'{selector} {operator} "{escaped_query}"'
 
-        result = self.query_range(logql, start=start, limit=limit)
-        entries = self.parse_log_entries(result)
+        result = await self.query_range(logql, start=start, limit=limit, max_line_chars=300)
+        batch = self.parse_log_entries(result)
 
         # Group by pod
         logs_by_pod = {}
-        for entry in entries:
-            pod = entry["labels"].get("pod_name", "unknown")
+        for timestamp_ns, msg, pod in zip(batch.timestamps, batch.messages, batch.pod_names):
             if pod not in logs_by_pod:
                 logs_by_pod[pod] = []
             logs_by_pod[pod].append({
-                "timestamp": entry["timestamp"].isoformat(),
-                "message": entry["message"][:300],
+                "timestamp": self.to_datetime(timestamp_ns).isoformat(),
+                "message": msg[:300],
             })
 
         return {
             "query": query,
-            "total_matches": len(entries),
+            "total_matches": len(batch),
             "logs_by_pod": logs_by_pod,
             "time_range_hours": hours,
         }
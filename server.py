@@ -4,9 +4,12 @@ import os
 import sys
 import logging
 import signal
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 from mcp.server.fastmcp import FastMCP
 from mcp.server.transport_security import TransportSecuritySettings
 from loki_client import LokiClient
+from starlette.applications import Starlette
 import uvicorn
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
@@ -53,20 +56,19 @@ mcp = FastMCP(
     ),
 )
 
-# Initialize Loki client
 loki_url = os.getenv("LOKI_URL", "http://loki.monitoring.svc.cluster.local:3100")
-logger.info(f"Initializing LokiClient with URL: {loki_url}")
-try:
-    loki = LokiClient(loki_url)
-    logger.info("LokiClient initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize LokiClient: {e}", exc_info=True)
-    # Continue anyway - tools will fail at call time if needed
-    loki = None
+
+
+def _get_loki() -> Optional[LokiClient]:
+    """Return the LokiClient created by the app lifespan.
+
+    Returns None only when a tool runs outside the HTTP app's lifespan.
+    """
+    return getattr(app.state, "loki", None)
 
 
 @mcp.tool()
-def get_error_summary(namespace: str = "", hours: int = 1) -> str:
+async def get_error_summary(namespace: str = "", hours: int = 1) -> str:
     """
     Get a summary of errors happening in your cluster.
 
@@ -80,33 +82,36 @@ def get_error_summary(namespace: str = "", hours: int = 1) -> str:
     Example: "What errors are happening in my cluster?"
     -> Call with namespace="", hours=1
     """
+    loki = _get_loki()
     if loki is None:
         return "Error: Loki client is not initialized. Check Loki service connectivity."
 
-    result = loki.get_error_summary(namespace=namespace, hours=hours)
+    result = await loki.get_error_summary(namespace=namespace, hours=hours)
 
     # Format as readable summary
-    summary = f"Error Summary (last {hours} hour(s)):\n"
-    summary += f"Total Errors: {result['total_errors']}\n"
+    lines = [
+        f"Error Summary (last {hours} hour(s)):",
+        f"Total Errors: {result['total_errors']}",
+    ]
 
     if result['error_breakdown']:
-        summary += "Error Breakdown:\n"
+        lines.append("Error Breakdown:")
         for error_type, count in result['error_breakdown'].items():
-            summary += f"  {error_type}: {count}\n"
+            lines.append(f"  {error_type}: {count}")
 
     if result['affected_pods']:
-        summary += f"Affected Pods: {', '.join(result['affected_pods'][:10])}\n"
+        lines.append(f"Affected Pods: {', '.join(result['affected_pods'][:10])}")
 
     if result['sample_errors']:
-        summary += "Sample Error Messages:\n"
+        lines.append("Sample Error Messages:")
         for msg in result['sample_errors'][:3]:
-            summary += f"  - {msg}\n"
+            lines.append(f"  - {msg}")
 
-    return summary
+    return "\n".join(lines) + "\n"
 
 
 @mcp.tool()
-def find_pod_restarts(namespace: str = "", hours: int = 1) -> str:
+async def find_pod_restarts(namespace: str = "", hours: int = 1) -> str:
     """
     Find pods that have restarted or crashed recently.
 
@@ -120,26 +125,29 @@ def find_pod_restarts(namespace: str = "", hours: int = 1) -> str:
     Example: "Which pods are crashing in my cluster?"
     -> Call with namespace="", hours=2
     """
+    loki = _get_loki()
     if loki is None:
         return "Error: Loki client is not initialized. Check Loki service connectivity."
 
-    result = loki.get_pod_restarts(namespace=namespace, hours=hours)
+    result = await loki.get_pod_restarts(namespace=namespace, hours=hours)
 
-    summary = f"Pod Restart Summary (last {hours} hour(s)):\n"
-    summary += f"Total Restart Events: {result['total_restart_events']}\n"
+    lines = [
+        f"Pod Restart Summary (last {hours} hour(s)):",
+        f"Total Restart Events: {result['total_restart_events']}",
+    ]
 
     if result['affected_pods']:
-        summary += "Pods with Restarts:\n"
+        lines.append("Pods with Restarts:")
         for pod, count in list(result['affected_pods'].items())[:10]:
-            summary += f"  {pod}: {count} events\n"
+            lines.append(f"  {pod}: {count} events")
             if pod in result['restart_reasons']:
-                summary += f"    Reason: {result['restart_reasons'][pod][:100]}\n"
+                lines.append(f"    Reason: {result['restart_reasons'][pod][:100]}")
 
-    return summary
+    return "\n".join(lines) + "\n"
 
 
 @mcp.tool()
-def search_logs(query: str, namespace: str = "", hours: int = 1, limit: int = 100) -> str:
+async def search_logs(query: str, namespace: str = "", hours: int = 1, limit: int = 100) -> str:
     """
     Search logs with a regex pattern.
 
@@ -155,25 +163,34 @@ def search_logs(query: str, namespace: str = "", hours: int = 1, limit: int = 10
     Example: "Find all logs mentioning 'timeout'"
     -> Call with query="timeout", namespace="", hours=2
     """
+    loki = _get_loki()
     if loki is None:
         return "Error: Loki client is not initialized. Check Loki service connectivity."
 
-    result = loki.search_logs(query=query, namespace=namespace, hours=hours, limit=limit)
+    try:
+        loki.validate_regex(query)
+    except ValueError as e:
+        return f"Error: {e}"
+
+    result = await loki.search_logs(query=query, namespace=namespace, hours=hours, limit=limit)
 
-    summary = f"Search Results for '{query}' (last {hours} hour(s)):\n"
-    summary += f"Total Matches: {result['total_matches']}\n\n"
+    lines = [
+        f"Search Results for '{query}' (last {hours} hour(s)):",
+        f"Total Matches: {result['total_matches']}",
+        "",
+    ]
 
     for pod, logs in list(result['logs_by_pod'].items())[:5]:
-        summary += f"Pod: {pod}\n"
+        lines.append(f"Pod: {pod}")
         for log in logs[:3]:
-            summary += f"  [{log['timestamp']}] {log['message']}\n"
-        summary += "\n"
+            lines.append(f"  [{log['timestamp']}] {log['message']}")
+        lines.append("")
 
-    return summary
+    return "\n".join(lines) + "\n"
 
 
 @mcp.tool()
-def list_namespaces() -> str:
+async def list_namespaces() -> str:
     """
     List all namespaces that have logs in Loki.
 
@@ -182,15 +199,16 @@ def list_namespaces() -> str:
 
     Example: "What namespaces are in my cluster?"
     """
+    loki = _get_loki()
     if loki is None:
         return "Error: Loki client is not initialized. Check Loki service connectivity."
 
-    namespaces = loki.get_namespaces()
+    namespaces = await loki.get_namespaces()
     return "Namespaces with logs:\n" + "\n".join(f"  - {ns}" for ns in namespaces)
 
 
 @mcp.tool()
-def get_pod_logs(pod_name: str, namespace: str = "", hours: int = 1, limit: int = 100) -> str:
+async def get_pod_logs(pod_name: str, namespace: str = "", hours: int = 1, limit: int = 100) -> str:
     """
     Get logs for a specific pod.
 
@@ -206,9 +224,15 @@ def get_pod_logs(pod_name: str, namespace: str = "", hours: int = 1, limit: int
     Example: "Show me logs from the ollama pod"
     -> Call with pod_name="ollama*", namespace="ai", hours=1
     """
+    loki = _get_loki()
     if loki is None:
         return "Error: Loki client is not initialized. Check Loki service connectivity."
 
+    try:
+        loki.validate_regex(pod_name)
+    except ValueError as e:
+        return f"Error: {e}"
+
     # Build query for specific pod
     if namespace:
         escaped_namespace = loki._escape_logql_string(namespace)
@@ -219,19 +243,39 @@ def get_pod_logs(pod_name: str, namespace: str = "", hours: int = 1, limit: int
         query = f'{{pod_name=~"{escaped_pod_name}"}}'
 
     start_time = __import__('datetime').datetime.now() - __import__('datetime').timedelta(hours=hours)
-    result = loki.query_range(query, start=start_time, limit=limit)
-    entries = loki.parse_log_entries(result)
+    result = await loki.query_range(query, start=start_time, limit=limit)
+    batch = loki.parse_log_entries(result)
 
-    summary = f"Logs for pod '{pod_name}' (last {hours} hour(s)):\n"
-    summary += f"Total Lines: {len(entries)}\n\n"
+    lines = [
+        f"Logs for pod '{pod_name}' (last {hours} hour(s)):",
+        f"Total Lines: {len(batch)}",
+        "",
+    ]
 
-    for entry in entries[-20:]:  # Show last 20 lines
-        summary += f"[{entry['timestamp'].isoformat()}] {entry['message']}\n"
+    # Show last 20 lines
+    for timestamp_ns, message in zip(batch.timestamps[-20:], batch.messages[-20:]):
+        lines.append(f"[{loki.to_datetime(timestamp_ns).isoformat()}] {message}")
 
-    return summary
+    return "\n".join(lines) + "\n"
 
 # Use the built-in FastMCP ASGI app so the transport matches the installed FastMCP SDK.
 app = mcp.streamable_http_app()
+_mcp_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    """Own one LokiClient, and its connection pool, for the server lifetime."""
+    logger.info(f"Initializing LokiClient with URL: {loki_url}")
+    app.state.loki = LokiClient(loki_url)
+    try:
+        async with _mcp_lifespan(app):
+            yield
+    finally:
+        await app.state.loki.aclose()
+
+
+app.router.lifespan_context = lifespan
 
 
 if __name__ == "__main__":